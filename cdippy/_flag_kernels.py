@@ -0,0 +1,23 @@
+""" Pub mask kernel used by cdippy.cdippy.CDIPnc.make_pub_mask, compiled with numba when it is installed. """
+
+import numpy as np
+
+from cdippy.cdippy import CDIPnc
+
+try:
+    import numba as nb
+except ImportError:
+    nb = None
+
+
+if nb is not None:
+    @nb.njit(cache=True)
+    def both_goodall_mask(primary, secondary):
+        """ Returns True unless the record is public-good or nonpub, in a single pass over 1-d flag arrays. """
+        out = np.empty(primary.shape[0], dtype=np.bool_)
+        for i in range(primary.shape[0]):
+            p = primary[i]
+            out[i] = not (p == 1 or (p == 4 and secondary[i] == 1))
+        return out
+else:
+    both_goodall_mask = CDIPnc.pub_mask_rules['both-goodall']
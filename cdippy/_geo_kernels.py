@@ -0,0 +1,26 @@
+""" Haversine batch kernel used by cdippy.location, compiled with numba when it is installed. """
+
+from math import sin, cos, sqrt, atan2
+
+import numpy as np
+
+from cdippy.location import central_angles
+
+try:
+    import numba as nb
+except ImportError:
+    nb = None
+
+
+if nb is not None:
+    @nb.njit(cache=True, fastmath=True, parallel=True)
+    def central_angle_batch(rlats, rlons, rlat0, rlon0):
+        """ Returns the central angles between each of rlats, rlons and rlat0, rlon0 (radians). """
+        out = np.empty(rlats.shape[0])
+        cos0 = cos(rlat0)
+        for i in nb.prange(rlats.shape[0]):
+            a = sin((rlats[i]-rlat0)/2)**2 + cos0*cos(rlats[i])*sin((rlons[i]-rlon0)/2)**2
+            out[i] = 2*atan2(sqrt(a), sqrt(1.0-a))
+        return out
+else:
+    central_angle_batch = central_angles
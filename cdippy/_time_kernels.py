@@ -0,0 +1,33 @@
+""" Interval kernels used by cdippy.utils.Timespan, compiled with numba when it is installed. """
+
+import numpy as np
+
+try:
+    import numba as nb
+except ImportError:
+    nb = None
+
+
+def _overlap_pairs_sorted(s1, e1, s2, e2):
+    """ Returns a K x 2 array of the (i, j) index pairs of overlapping spans, by a two-pointer sweep. """
+    out = np.empty((s1.shape[0] + s2.shape[0], 2), np.int64)
+    n = i = j = 0
+    while i < s1.shape[0] and j < s2.shape[0]:
+        if s1[i] <= e2[j] and e1[i] >= s2[j]:
+            out[n, 0] = i
+            out[n, 1] = j
+            n += 1
+        #- Advance whichever span ends first, it can not overlap anything later in the other set
+        if e1[i] < e2[j]:
+            i += 1
+        elif e2[j] < e1[i]:
+            j += 1
+        else:
+            i += 1
+            j += 1
+    return out[:n]
+
+if nb is not None:
+    overlap_pairs_sorted = nb.njit(cache=True)(_overlap_pairs_sorted)
+else:
+    overlap_pairs_sorted = _overlap_pairs_sorted
@@ -0,0 +1,29 @@
+# cython: language_level=3
+""" Compiled versions of cdippy.utils date helpers, built by setup.py when Cython is installed. """
+
+from cpython.datetime cimport import_datetime, datetime_new
+
+import_datetime()
+
+
+cpdef object cdip_datetime(str cdip_str):
+    """ Returns the datetime for a yyyy[mm[dd[HH[MM[SS]]]]] string, or None if it is not valid. """
+    cdef Py_ssize_t i, l = len(cdip_str)
+    cdef Py_UCS4 c
+    cdef int f
+    cdef int fields[6]
+    if l > 14 or l < 4 or l % 2 != 0:
+        return None
+    fields[:] = [0, 1, 1, 0, 0, 0]
+    for i in range(l):
+        c = cdip_str[i]
+        if c < 48 or c > 57: # '0'..'9'
+            return None
+        f = 0 if i < 4 else (i - 2) // 2
+        if i == 4 or (i > 4 and i % 2 == 0):
+            fields[f] = 0 # Field present, drop its default
+        fields[f] = fields[f]*10 + (<int>c - 48)
+    try:
+        return datetime_new(fields[0], fields[1], fields[2], fields[3], fields[4], fields[5], 0, None)
+    except ValueError:
+        return None
@@ -1,16 +1,26 @@
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from functools import lru_cache
 import os
+import re
+import time
 
 import netCDF4
 
 import numpy as np
-import numbers 
-from bisect import bisect_left, bisect_right
 
 import cdippy.ndbc as ndbc
 import cdippy.utils as cu
 import cdippy.url_utils as uu
 
+#- Everything up to the first uppercase letter, e.g. 'wave' in 'waveHs'
+var_prefix_re = re.compile(r'[^A-Z]*')
+
+@lru_cache(maxsize=256)
+def var_prefix(var_name):
+    """ Returns 'wave' part of the string 'waveHs'. """
+    return var_prefix_re.match(var_name).group(0)
+
 class CDIPnc:
     """ A base class to handle CDIP nc data files located either locally or remotely. """
 
@@ -20,6 +30,18 @@ class CDIPnc:
     #- Load_stn_nc_files only checks for this number of deployments
     max_deployments = 99
 
+    #- Vars read by most requests get a larger chunk cache when the file is NetCDF4/HDF5
+    chunk_cache_vars = [
+        'waveTime', 'waveHs', 'waveFlagPrimary', 'waveFlagSecondary',
+        'sstTime', 'sstSeaSurfaceTemperature', 'sstFlagPrimary', 'sstFlagSecondary']
+    chunk_cache = (16*1024*1024, 1009, 0.75) # size in bytes, nelems, preemption
+
+    #- Number of threads get_dataset_urls uses to load THREDDS station catalogs
+    catalog_workers = 32
+
+    #- Half width of the time window get_time_indices reads around each estimated index
+    time_search_window = 64
+
     #- Top level data dir for nc files. Files must be within subdirectories:
     #- i.e. <data_dir>/REALTIME, <data_dir>/ARCHIVE/201p1
     data_dir = None
@@ -57,9 +79,38 @@ class CDIPnc:
         'both-good',   'both-bad',   'both-all' , 'both-badall', 'both-goodall']
     pub_set_default = 'public-good' 
 
+    # Mask rules on the plain flag data (p=primary, s=secondary). Pub sets 
+    # not listed here get the public-good mask.
+    pub_mask_rules = {
+        'public-good':  lambda p, s: p != 1,
+        'nonpub-all':   lambda p, s: ~((p == 4) & (s == 1)),
+        'public-all':   lambda p, s: (p == 4) & (s == 1),
+        'both-goodall': lambda p, s: ~((p == 1) | ((p == 4) & (s == 1))),
+        'public-bad':   lambda p, s: (p == 1) | ((p == 4) & (s == 1)),
+        'both-badall':  lambda p, s: p == 1,
+    }
+
+    # Pub sets whose rule reads the secondary flag, so missing secondary flags are masked too
+    pub_sets_using_secondary = {'nonpub-all', 'public-all', 'both-goodall', 'public-bad'}
+
     # Applies the mask before data is returned
     apply_mask = True
 
+    # Nc variable handles for the currently loaded cls.nc (see get_var)
+    _var_cache = None
+    _var_cache_nc = None
+
+    # Remote urls that have been found to exist (see get_nc and probe_urls)
+    _existing_urls = set()
+
+    # Remote urls that have been found not to exist, with the time of the check
+    _missing_urls = {}
+    missing_url_ttl = 300 # Seconds a missing url is taken to still be missing
+
+    # Masks built by make_pub_masks for the currently loaded cls.nc
+    _pub_mask_cache = None
+    _pub_mask_cache_nc = None
+
     # REQUESTING DATA PROCEDURE
     # 1. For a given set of variables of the same type (e.g. 'wave'), 
     #   a. determine the dimension var name and if it is a time dimension
@@ -110,9 +161,9 @@ class CDIPnc:
         save = {}
         result = {}
 
-        #- Check if requested variable 0 exists
+        #- Check if requested variable 0 exists and has data
         first_var = cls.get_var(cls.vrs[0])
-        if first_var is None:
+        if first_var is None or first_var.size == 0:
             return result
 
         # Use first var to determine the dimension, grab it and find indices
@@ -121,17 +172,15 @@ class CDIPnc:
             nc_var = cls.get_var(dim_name)
             if nc_var is None: # To handle non-existing "count" variables
                 continue
-            if nc_var.units[0:7] == 'seconds':
+            if getattr(nc_var, 'units', '').startswith('seconds'):
                 time_dim = dim_name
-                #dim_data = np.ma.asarray(cls.nc.variables[dim_name][:])
-                dim_data = cls.make_masked_array(nc_var, 0, nc_var.size)
                 #- find time dimension start and end indices
-                s_idx, e_idx = cls.get_indices(dim_data[:], cls.start_stamp, cls.end_stamp)
+                s_idx, e_idx = cls.get_time_indices(nc_var, cls.start_stamp, cls.end_stamp)
                 if s_idx == e_idx:
                     return result
-                mask_results[time_dim] = dim_data[s_idx:e_idx]
+                mask_results[time_dim] = cls.make_masked_array(nc_var, s_idx, e_idx)
             else: # E.g. waveFrequency (Do I want to add to result?
-                save[dim_name] = cls.nc.variables[dim_name]
+                save[dim_name] = nc_var
 
         # Grab the time subset of each variable 
         for v_name in cls.vrs:
@@ -139,7 +188,7 @@ class CDIPnc:
             if v is None:
                 continue
             if len(v.dimensions) == 1 and v.dimensions[0] == 'maxStrlen64':
-                arr = cls.nc.variables[v_name][:]
+                arr = v[:]
                 result[v_name] = cls.byte_arr_to_string(arr).strip('\x00')
             elif time_dim: 
                 mask_results[v_name] = cls.make_masked_array(v, s_idx, e_idx)
@@ -158,25 +207,27 @@ class CDIPnc:
                 result[v_name] = cls.make_masked_array(v, 0, v_len)
 
         # Use first var to determine the ancillary variable, e.g. waveFlagPrimary
-        # If there is an ancillary variable, use pub/nonpub to create a mask
-        if hasattr(first_var, 'ancillary_variables'): 
+        # If there is an ancillary variable, use pub/nonpub to create a mask.
+        # The flags are only read if the mask is going to be applied.
+        anc_mask = None
+        if cls.apply_mask and hasattr(first_var, 'ancillary_variables'): 
             anc_names = first_var.ancillary_variables.split(' ')
             anc_name = anc_names[0]
             # Create the variable mask using pub/nonpub choice
             if not time_dim:
-               s_idx = None 
+               s_idx, e_idx = None, None
             anc_mask = cls.make_pub_mask(anc_name, s_idx, e_idx) 
-        else:
-            anc_mask = None
 
-        # Still a problem. 2-d vars.
-        # Seems to work if the variable has no mask set. But
-        # if mask set, returns 1-d var.
-        for v_name in mask_results:
-            if cls.apply_mask and anc_mask is not None:
-                v = mask_results[v_name]
-                mask_results[v_name] = v[~anc_mask]
-            result[v_name] = mask_results[v_name]
+        # Index the data and mask arrays separately; masked array __getitem__
+        # is much slower than plain ndarray boolean indexing. Indexing the
+        # first axis keeps the rows of 2-d vars intact.
+        keep = ~anc_mask if anc_mask is not None else None
+        for v_name, v in mask_results.items():
+            if cls.apply_mask and keep is not None:
+                data = np.ma.getdata(v)[keep]
+                mask = np.ma.getmaskarray(v)[keep]
+                v = np.ma.array(data, mask=mask, fill_value=v.fill_value, copy=False)
+            result[v_name] = v
 
         return result
 
@@ -184,6 +235,9 @@ class CDIPnc:
         """ 
             Returns a numpy masked array of the specified start and end indices
             where e_idx is appropriate for python arrays. I.e. one more than last index
+
+            Nc files are opened with always_mask off, so the mask is only a full
+            array if the slice contains missing values.
         """
         if len(nc_var.shape) <= 1:
             try:
@@ -209,36 +263,40 @@ class CDIPnc:
 
         # No s_idx, use whole array. Otherwise time subset the anc var.
         nc_primary = cls.get_var(anc_name)
+        if nc_primary is None:
+            return None
         secondary_name  = cls.get_var_prefix(anc_name)+'FlagSecondary'
         nc_secondary = cls.get_var(secondary_name)
         if s_idx is None:
             s_idx = 0
             e_idx = len(nc_primary) 
+        # Nothing to mask, skip reading the flags
+        if e_idx - s_idx <= 0:
+            return np.zeros((0,)+nc_primary.shape[1:], dtype=bool)
         primary_arr = nc_primary[s_idx:e_idx]
+        secondary_arr = None
         if nc_secondary is not None:
             secondary_arr = nc_secondary[s_idx:e_idx]
 
         if anc_name == 'waveFlagPrimary' or anc_name == 'sstFlagPrimary':
-            public_good = primary_arr==1 # Put a ~ in front for correct mask value
+            p = np.ma.getdata(primary_arr)
             if cls.pub_set == 'public-good':
-                return np.ma.make_mask( ~public_good, shrink=False )
-
-            # All of the below need the secondary array and nonpub mask
-            nonpub_all = (primary_arr==4) & (secondary_arr==1) 
-
-            # Return appropriate mask for pub designation
-            if cls.pub_set == 'nonpub-all':
-                return np.ma.make_mask( ~nonpub_all, shrink=False )
-            elif cls.pub_set == 'public-all':
-                return np.ma.make_mask( nonpub_all, shrink=False )
-            elif cls.pub_set == 'both-goodall':
-                return np.ma.make_mask( ~(public_good | nonpub_all), shrink=False )
-            elif cls.pub_set == 'public-bad':
-                return np.ma.make_mask( public_good | nonpub_all, shrink=False )
-            elif cls.pub_set == 'both-badall':
-                return np.ma.make_mask( public_good , shrink=False)
-            else:
-                return np.ma.make_mask( ~public_good, shrink=False )
+                # Not equal, rather than ~(primary_arr==1), saves a pass
+                return np.ma.make_mask( primary_arr!=1, shrink=False )
+
+            # Evaluate both-goodall in a single fused pass with numba, if installed
+            s = np.ma.getdata(secondary_arr) if secondary_arr is not None else None
+            if cls.pub_set == 'both-goodall' and s is not None:
+                from cdippy._flag_kernels import both_goodall_mask # Here, as importing numba is slow
+                mask = both_goodall_mask(p.ravel(), s.ravel()).reshape(p.shape)
+                return cls.mask_flag_fills(mask, primary_arr, secondary_arr)
+
+            # Otherwise one NumPy expression per pub set, on the plain flag data
+            rule = cls.pub_mask_rules.get(cls.pub_set, cls.pub_mask_rules['public-good'])
+            mask = rule(p, s)
+            if cls.pub_set in cls.pub_sets_using_secondary:
+                return cls.mask_flag_fills(mask, primary_arr, secondary_arr)
+            return cls.mask_flag_fills(mask, primary_arr)
         elif anc_name == 'waveFrequencyFlagPrimary':
             pass
         elif anc_name == 'gpsStatusFlags':
@@ -246,6 +304,27 @@ class CDIPnc:
         else:
             return None
 
+    def make_pub_masks(cls, anc_names, s_idx=None, e_idx=None):
+        """ Returns a dict of make_pub_mask results keyed by ancillary variable name. Masks are cached per nc object. """
+        if cls._pub_mask_cache_nc is not cls.nc:
+            cls._pub_mask_cache = {}
+            cls._pub_mask_cache_nc = cls.nc
+        masks = {}
+        for anc_name in anc_names:
+            key = (anc_name, s_idx, e_idx, cls.pub_set)
+            if key not in cls._pub_mask_cache:
+                cls._pub_mask_cache[key] = cls.make_pub_mask(anc_name, s_idx, e_idx)
+            masks[anc_name] = cls._pub_mask_cache[key]
+        return masks
+
+    def mask_flag_fills(cls, mask, *flag_arrs):
+        """ Masks out records with missing flags, as np.ma.make_mask does for masked flag arrays. """
+        for arr in flag_arrs:
+            fills = np.ma.getmask(arr)
+            if fills is not np.ma.nomask:
+                mask |= fills
+        return mask
+
     def get_pub_set(cls, name):
         """ Returns standard pub/nonpub set name given a name. """
         # Aliases
@@ -271,12 +350,7 @@ class CDIPnc:
 
     def get_var_prefix(cls, var_name):
         """ Returns 'wave' part of the string 'waveHs'. """
-        s = ''
-        for c in var_name:
-            if c.isupper():
-                break
-            s += c
-        return s
+        return var_prefix(var_name)
 
     def get_flag_meanings(cls, flag_name):
         """ Returns flag category values and meanings given a flag_name, e.g. 'waveFlagPrimary' """
@@ -285,7 +359,7 @@ class CDIPnc:
     def get_flag_values(cls, flag_name):
         """ Returns flag category values and meanings given a flag_name, e.g. 'waveFlagPrimary' """
         v = cls.get_var(flag_name)
-        if flag_name[0:3] == 'gps':
+        if flag_name.startswith('gps'):
             return v.flag_masks
         else:
             return v.flag_values
@@ -304,15 +378,45 @@ class CDIPnc:
 
     def get_indices(cls, times, start_stamp, end_stamp):
         """ Returns start and end indices to include any times that are equal to start_stamp or end_stamp.  """
-        s_idx = bisect_left(times,start_stamp) # Will include time if equal
-        e_idx = bisect_right(times,end_stamp,s_idx) # Will give e_idx appropriate for python arrays
-        return s_idx, e_idx
+        times = np.asarray(times) # Search the plain data, not the masked array
+        s_idx = int(np.searchsorted(times, start_stamp, side='left')) # Will include time if equal
+        e_idx = int(np.searchsorted(times, end_stamp, side='right')) # Will give e_idx appropriate for python arrays
+        return s_idx, max(s_idx, e_idx)
+
+    def get_time_indices(cls, nc_var, start_stamp, end_stamp):
+        """ Same as get_indices but only reads small windows of the (sorted) time variable nc_var. """
+        n = nc_var.size
+        w = cls.time_search_window
+        if n <= 4*w:
+            return cls.get_indices(nc_var[:], start_stamp, end_stamp)
+        t_first, t_last = nc_var[0], nc_var[n-1]
+        if t_first is np.ma.masked or t_last is np.ma.masked or t_last <= t_first:
+            return cls.get_indices(nc_var[:], start_stamp, end_stamp)
+        t_first, t_last = float(t_first), float(t_last)
+        idxs = []
+        for stamp, side in [(start_stamp, 'left'), (end_stamp, 'right')]:
+            #- Estimate the index assuming uniform sampling, then search a window around it
+            est = int((stamp - t_first) / (t_last - t_first) * (n-1))
+            est = min(max(est, 0), n-1)
+            lo, hi = max(0, est-w), min(n, est+w)
+            win = np.asarray(nc_var[lo:hi])
+            i = int(np.searchsorted(win, stamp, side=side))
+            if (i == 0 and lo > 0) or (i == len(win) and hi < n):
+                # Estimate was off by more than the window, use the whole array
+                return cls.get_indices(nc_var[:], start_stamp, end_stamp)
+            idxs.append(lo+i)
+        s_idx, e_idx = idxs
+        return s_idx, max(s_idx, e_idx)
 
     def get_nc(cls,url=None):
         if url is None:
             url = cls.url
         # Check if the html page or file exists
-        if (url[0:4] == 'http' and not uu.url_exists(url+'.html')) and not os.path.isfile(url):
+        if url.startswith('http') and url not in CDIPnc._existing_urls:
+            if cls.url_missing(url):
+                return None
+            if not uu.url_exists(url+'.html') and not os.path.isfile(url):
+                CDIPnc._missing_urls[url] = time.time()
                 return None
         try:
             nc = netCDF4.Dataset(url)
@@ -322,15 +426,53 @@ class CDIPnc:
                 nc = netCDF4.Dataset(url)
             except:
                 nc = None
+        # Slices come back as plain ndarrays unless they hold missing values,
+        # which keeps the flag and time arrays off the slow masked array paths.
+        if nc is not None:
+            if url.startswith('http'):
+                CDIPnc._existing_urls.add(url)
+            nc.set_always_mask(False)
+            # Chunk caches only exist for the HDF5 based formats (not netCDF3 or DAP)
+            if nc.data_model.startswith('NETCDF4'):
+                for name in cls.chunk_cache_vars:
+                    if name in nc.variables:
+                        nc.variables[name].set_var_chunk_cache(*cls.chunk_cache)
         return nc
 
+    def probe_urls(cls, urls, max_workers=8):
+        """ Checks in parallel which remote urls exist, so get_nc can skip the check for them. """
+        todo = [url for url in urls 
+            if url.startswith('http') and url not in CDIPnc._existing_urls and not cls.url_missing(url)]
+        if not todo:
+            return
+        #- Only the http checks are threaded, the netCDF library itself is not thread safe
+        with ThreadPoolExecutor(max_workers=max_workers) as ex:
+            for url, exists in zip(todo, ex.map(lambda url: uu.url_exists(url+'.html'), todo)):
+                if exists:
+                    CDIPnc._existing_urls.add(url)
+                else:
+                    CDIPnc._missing_urls[url] = time.time()
+
+    def url_missing(cls, url):
+        """ Returns True if url was found not to exist within the last missing_url_ttl seconds. """
+        checked = CDIPnc._missing_urls.get(url)
+        return checked is not None and time.time() - checked < cls.missing_url_ttl
+
     def byte_arr_to_string(cls, b_arr):
+        """ Returns the string held in a 1-d char array, dropping masked and null bytes. """
         if np.ma.is_masked(b_arr):
-            b_arr = b_arr[~b_arr.mask]
-        s = ''
-        for c in b_arr[:].astype('U'):
-            s += c
-        return s
+            b_arr = b_arr.compressed()
+        return np.asarray(b_arr).tobytes().decode('ascii', 'ignore').replace('\x00', '')
+
+    def byte_arr_to_strings(cls, b_arr):
+        """ Returns a list of strings, one per row of a 2-d char array, decoded in one pass. """
+        if np.ma.isMaskedArray(b_arr):
+            b_arr = b_arr.filled(b'\x00')
+        b_arr = np.ascontiguousarray(b_arr)
+        rows = b_arr.view('S'+str(b_arr.shape[1])).reshape(-1)
+        strs = np.char.decode(rows, 'ascii', 'ignore').tolist()
+        # Trailing nulls are already dropped by the 'S' view, embedded ones are not
+        return [s.replace('\x00', '') for s in strs]
 
     def metaStationName(cls):
         """ Get list of latest stations """
@@ -340,9 +482,15 @@ class CDIPnc:
 
     def get_var(cls, var_name):
         """ Checks if a variable exists then returns a pointer to it """
-        if cls.nc is None or var_name not in cls.nc.variables:
+        if cls.nc is None:
             return None
-        return cls.nc.variables[var_name]
+        # Handles are cached per nc object, so reloading cls.nc resets the cache
+        if cls._var_cache_nc is not cls.nc:
+            cls._var_cache = {}
+            cls._var_cache_nc = cls.nc
+        if var_name not in cls._var_cache:
+            cls._var_cache[var_name] = cls.nc.variables.get(var_name)
+        return cls._var_cache[var_name]
 
     def get_dataset_urls(cls):
         """ 
@@ -359,12 +507,12 @@ class CDIPnc:
             result = {'realtime': [], 'archive': []}
             #- Walk through data_dir sub dirs
             for (dirpath, dirnames, filenames) in os.walk(cls.data_dir):
-                if dirpath.find('REALTIME') >= 0:
+                if 'REALTIME' in dirpath:
                     for file in filenames:
                         if os.path.splitext(file)[1] == '.nc':
                             result['realtime'].append(
                                 os.path.join(dirpath, file))
-                elif dirpath.find('ARCHIVE') >= 0:
+                elif 'ARCHIVE' in dirpath:
                     for file in filenames:
                         if os.path.splitext(file)[1] == '.nc':
                             result['archive'].append(
@@ -377,36 +525,41 @@ class CDIPnc:
         root = uu.load_et_root(catalog_url)
         catalogs = []
         uu.rfindta(root, catalogs, 'catalogRef', 'href')
+        dods_pre = '/'.join([cls.domain, cls.dods, 'cdip'])+'/'
         for catalog in catalogs:
             #- Archive data sets
             url = cls.domain + catalog
             cat = uu.load_et_root(url)
-            if catalog.find('archive') >= 0:
+            if 'archive' in catalog:
                 ar_urls = []
                 uu.rfindta(cat, ar_urls, 'catalogRef', 'href')
                 b_url = os.path.dirname(url)
                 #- Station datasets
                 ar_ds_urls = []
-                for u in ar_urls:
-                    url = b_url + '/' + u
-                    ds = uu.load_et_root(url)
-                    uu.rfindta(ds, ar_ds_urls, 'dataset', 'urlPath')
-                full_urls = []
-                for url in ar_ds_urls:
-                    full_urls.append('/'.join([cls.domain, cls.dods, 'cdip', url[5:]]))
-                result['archive'] = full_urls
-            elif catalog.find('realtime') >= 0:
+                #- Catalog fetches are independent and I/O bound, so load them in threads
+                with ThreadPoolExecutor(max_workers=cls.catalog_workers) as ex:
+                    roots = ex.map(uu.load_et_root, [b_url + '/' + u for u in ar_urls])
+                    for ds in roots:
+                        uu.rfindta(ds, ar_ds_urls, 'dataset', 'urlPath')
+                result['archive'] = [dods_pre+url[5:] for url in ar_ds_urls]
+            elif 'realtime' in catalog:
                 rt_ds_urls = []
                 uu.rfindta(cat, rt_ds_urls, 'dataset', 'urlPath')
-                full_urls = []
-                for url in rt_ds_urls:
-                    full_urls.append('/'.join([cls.domain, cls.dods, 'cdip', url[5:]]))
-                result['realtime'] = full_urls
+                result['realtime'] = [dods_pre+url[5:] for url in rt_ds_urls]
         return result
 
     def set_dataset_info(cls, stn, org, dataset_name, deployment=None):
+        """ Sets cls.stn,org,filename,url. Loads cls.nc. Arguments should all be lower case. """
+        if org is None:
+            org = 'cdip'
+        cls.filename, cls.url = cls.make_dataset_url(stn, org, dataset_name, deployment)
+        cls.stn = stn
+        cls.org = org
+        cls.nc = cls.get_nc()
+
+    def make_dataset_url(cls, stn, org, dataset_name, deployment=None):
         """  
-            Sets cls.stn,org,filename,url. Loads cls.nc. Arguments should all be lower case.
+            Returns (filename, url) of a dataset. Arguments should all be lower case.
 
             Paths are:
                 <top_dir>/EXTERNAL/WW3/<filename>  [filename=<stn>_<org_dir>_<dataset_name>.nc][CDIP stn like 192w3]
@@ -459,19 +612,16 @@ class CDIPnc:
             elif dataset_name == 'archive' and deployment:
                 dataset_name = deployment
                 dataset_dir = '/'.join([dataset_dir,stn])
-            cls.filename = '_'.join([stn,dataset_name+ext])
-            cls.url = '/'.join([url_pre,dataset_dir,cls.filename])
+            filename = '_'.join([stn,dataset_name+ext])
+            url = '/'.join([url_pre,dataset_dir,filename])
         else:
             if stn[3:4] == 'p' and org == 'ww3':  # Cdip stn id
                 stn_tmp = ndbc.get_wmo_id(stn[0:3])
             else:
                 stn_tmp = stn
-            cls.filename = '_'.join([stn_tmp, org_dir, dataset_name+ext])
-            cls.url = '/'.join([url_pre,org_dir,cls.filename])
-
-        cls.stn = stn
-        cls.org = org
-        cls.nc = cls.get_nc()
+            filename = '_'.join([stn_tmp, org_dir, dataset_name+ext])
+            url = '/'.join([url_pre,org_dir,filename])
+        return filename, url
 
 
 class Latest(CDIPnc):
@@ -487,6 +637,7 @@ class Latest(CDIPnc):
     def __init__(cls, data_dir=None):
         CDIPnc.__init__(cls, data_dir)
         cls.labels = []  # - Holds stn labels, e.g. '100p1' for this instance
+        cls._station_names = None  # - Decoded metaStationName list, set on first use
         # Set latest timespan (Latest_3day goes up to 30 minutes beyond now)
         now_plus_30min = datetime.utcnow() + timedelta(minutes=30)
         now_minus_4days = datetime.utcnow() - timedelta(days=4)
@@ -504,17 +655,16 @@ class Latest(CDIPnc):
         """ Get list of latest stations """
         if cls.nc is None:
             return None
-        names = []
-        for name_arr in cls.nc.variables['metaStationName']:
-            names.append(cls.byte_arr_to_string(name_arr))
-        return names
+        if cls._station_names is None:
+            cls._station_names = cls.byte_arr_to_strings(cls.nc.variables['metaStationName'][:])
+        return cls._station_names
 
     def metaSiteLabels(cls):
         """ Set cls.labels list withstations, e.g. ['100p1',...] """
         if cls.nc is None:
             return None
-        for label_arr in cls.nc.variables['metaSiteLabel']:
-            cls.labels.append(cls.byte_arr_to_string(label_arr))
+        if not cls.labels:
+            cls.labels = cls.byte_arr_to_strings(cls.nc.variables['metaSiteLabel'][:])
         return cls.labels
 
     def get_latest(cls, pub_set='public',meta_vars=None, wave_params=None):
@@ -527,29 +677,36 @@ class Latest(CDIPnc):
         wave_params = wave_params 
         cls.pub_set = cls.get_pub_set(pub_set)
         
-        # Create a mask to remove nonpub (or in general filter on pub)
-        if any('wave' in s for s in wave_params):
-            # Get wave variables: waveHs, waveTp, ...
-            cls.vrs = wave_params
-            cls.vrs.append('waveTimeOffset')
-            cls.vrs.append('waveTimeBounds')
+        needs_wave = any(s.startswith('wave') for s in wave_params)
+        needs_sst = 'sstSeaSurfaceTemperature' in wave_params
+
+        # Request wave and sst variables together (without appending to the
+        # caller's wave_params list): waveHs, waveTp, ...
+        cls.vrs = list(wave_params)
+        if needs_wave:
+            cls.vrs += ['waveTimeOffset', 'waveTimeBounds']
+        if needs_sst:
+            cls.vrs += ['sstTime', 'sstTimeOffset', 'sstTimeBounds']
+        if needs_wave or needs_sst:
             r = cls.get_request()
-            pub_mask = cls.make_pub_mask('waveFlagPrimary', None, None)
-            mask = np.ma.mask_or(r['waveTimeOffset'].mask, pub_mask)
-            r['waveTimeOffset'].mask = mask
+
+        # Create the masks to remove nonpub (or in general filter on pub) in one call
+        anc_names = []
+        if needs_wave:
+            anc_names.append('waveFlagPrimary')
+        if needs_sst:
+            anc_names.append('sstFlagPrimary')
+        pub_masks = cls.make_pub_masks(anc_names)
+
+        if needs_wave:
+            pub_mask = pub_masks['waveFlagPrimary']
+            r['waveTimeOffset'].mask = cls.or_masks(r['waveTimeOffset'], pub_mask)
             # Index to latest data for each station. If -1, then station is masked
             ixs = cls.get_latest_ixs(r['waveTimeOffset'])
 
-        # Create a mask to remove nonpub for sst(or in general filter on pub)
-        if 'sstSeaSurfaceTemperature' in wave_params:
-            # Get sst variables
-            cls.vrs.append('sstTime')
-            cls.vrs.append('sstTimeOffset')
-            cls.vrs.append('sstTimeBounds')
-            r = cls.get_request()
-            pub_mask = cls.make_pub_mask('sstFlagPrimary', None, None)
-            mask = np.ma.mask_or(r['sstTimeOffset'].mask, pub_mask)
-            r['sstTimeOffset'].mask = mask
+        if needs_sst:
+            pub_mask = pub_masks['sstFlagPrimary']
+            r['sstTimeOffset'].mask = cls.or_masks(r['sstTimeOffset'], pub_mask)
             # Index to latest sst data for each station. If -1, then station is masked
             ixs_sst = cls.get_latest_ixs(r['sstTimeOffset'])
 
@@ -564,50 +721,53 @@ class Latest(CDIPnc):
         z = r.copy()
         z.update(m)
 
+        # Gather each station's latest record with one fancy-indexed read per variable
+        ixs = np.asarray(ixs)
+        good = ixs >= 0
+        stns = np.arange(len(ixs))[good]
+        w_ixs = ixs[good]
+        if needs_sst:
+            s_ixs = np.asarray(ixs_sst)[good]
+
         result = {}
         for pm in z:
-            arr = []
-            for stn in range(len(ixs)):
-                if ixs[stn] >= 0:
-                    if pm == 'waveTime':
-                        arr.append(z['waveTime'][ixs[stn]] +
-                                   z['waveTimeOffset'][ixs[stn], stn])
-                    elif pm == 'waveTimeBounds':
-                        arr.append(z['waveTimeBounds'][ixs[stn]] +
-                                   z['waveTimeOffset'][ixs[stn], stn])
-                    elif pm == 'sstTimeBounds':
-                        arr.append(z['sstTimeBounds'][ixs_sst[stn]] +
-                                   z['sstTimeOffset'][ixs_sst[stn], stn])
-                    elif pm == 'sstTime':
-                        arr.append(z['sstTime'][ixs_sst[stn]] +
-                                   z['sstTimeOffset'][ixs_sst[stn], stn])
-                    elif pm == 'sstSeaSurfaceTemperature':
-                        arr.append(z[pm][ixs_sst[stn], stn])
-                    elif pm in cls.vrs or pm == 'metaStationName' or pm == 'metaSiteLabel': 
-                        arr.append(z[pm][stn])
-                    else:
-                        arr.append(z[pm][ixs[stn], stn])
-            result[pm] = arr
+            if pm == 'waveTime':
+                arr = z['waveTime'][w_ixs] + z['waveTimeOffset'][w_ixs, stns]
+            elif pm == 'waveTimeBounds':
+                arr = z['waveTimeBounds'][w_ixs] + z['waveTimeOffset'][w_ixs, stns][:, None]
+            elif pm == 'sstTimeBounds':
+                arr = z['sstTimeBounds'][s_ixs] + z['sstTimeOffset'][s_ixs, stns][:, None]
+            elif pm == 'sstTime':
+                arr = z['sstTime'][s_ixs] + z['sstTimeOffset'][s_ixs, stns]
+            elif pm == 'sstSeaSurfaceTemperature':
+                arr = z[pm][s_ixs, stns]
+            elif pm == 'metaStationName' or pm == 'metaSiteLabel':
+                arr = [z[pm][stn] for stn in stns]
+            elif pm in cls.vrs:
+                arr = z[pm][stns]
+            else:
+                arr = z[pm][w_ixs, stns]
+            result[pm] = list(arr)
         result.pop('waveTimeOffset', None)
         return result
 
-    def has_a_number(cls, arr):
-        """ Test if there is at least one number in the array """
-        for x in arr:
-            if isinstance(x, numbers.Number):
-                return True
-        return False
+    def or_masks(cls, arr, pub_mask):
+        """ Returns the union of arr's mask and pub_mask as a plain boolean array. """
+        mask = np.ma.getmaskarray(arr)
+        # A 1-d mask along time applies to every station
+        if pub_mask.ndim < mask.ndim:
+            pub_mask = pub_mask[:, None]
+        return mask | pub_mask
 
     def get_latest_ixs(cls, waveTimeOffset):
-        s = 0
-        ixs = []
-        while s < waveTimeOffset.shape[1]:
-            if cls.has_a_number(waveTimeOffset[:, s]):
-                ixs.append(np.ma.flatnotmasked_edges(waveTimeOffset[:, s])[1])
-            else:
-                ixs.append(-1)
-            s += 1
-        return ixs
+        """ Returns, for each station (column), the index of its last unmasked record or -1. """
+        valid = ~np.ma.getmaskarray(waveTimeOffset)
+        if valid.shape[0] == 0:
+            return [-1] * valid.shape[1]
+        # Last True in each column is the first True of the reversed column
+        ixs = (valid.shape[0] - 1) - np.argmax(valid[::-1], axis=0)
+        ixs[~valid.any(axis=0)] = -1
+        return ixs.tolist()
 
 class Realtime(CDIPnc):
     """ Loads the realtime nc file for the given station. """
@@ -627,36 +787,41 @@ class Historic(CDIPnc):
 class Archive(CDIPnc):
     """ Loads an archive (deployment) file for a given station and deployment. """
 
+    _xyz_meta = None
+    _xyz_meta_nc = None
+
     def __init__(cls, stn, deployment=None, data_dir=None, org=None):
         CDIPnc.__init__(cls, data_dir)
         if not deployment:
             deployment = 'd01'
         cls.set_dataset_info(stn, org, 'archive', deployment)
 
+    def get_xyz_meta(cls):
+        """ Returns the xyz start time, sample rate and filter delay, read once per nc object """
+        if cls._xyz_meta_nc is not cls.nc:
+            t0 = float(cls.get_var('xyzStartTime')[0])
+            r = float(cls.get_var('xyzSampleRate')[0])
+            # Mark I will have filter delay set to fill value
+            d = cls.get_var('xyzFilterDelay')
+            d = 0.0 if d is None or d[0] is np.ma.masked else float(d[0])
+            cls._xyz_meta = (t0, r, d)
+            cls._xyz_meta_nc = cls.nc
+        return cls._xyz_meta
+
     def get_idx_from_timestamp(cls, timestamp):
-        t0 = cls.get_var('xyzStartTime')[0]
-        r = cls.get_var('xyzSampleRate')[0]
-        # Mark I will have filter delay set to fill value
-        d = cls.get_var('xyzFilterDelay')
-        d = 0 if d[0] is np.ma.masked else d[0]
+        t0, r, d = cls.get_xyz_meta()
         return int(round(r*(timestamp - t0 + d),0))
 
     def make_xyzTime(cls, start_idx, end_idx):
-        t0 = np.ma.asarray(cls.get_var('xyzStartTime')[0])
-        r = np.ma.asarray(cls.get_var('xyzSampleRate')[0])
-        # Mark I will have filter delay set to fill value
-        d = cls.get_var('xyzFilterDelay')
-        d = 0 if d[0] is np.ma.masked else d[0]
-        d = np.ma.asarray(d)
-        i = np.ma.asarray(range(start_idx, end_idx))
-        return t0 - d + i/r
+        t0, r, d = cls.get_xyz_meta()
+        # Compute in place in a single float64 buffer: i/r + (t0 - d)
+        t = np.arange(start_idx, end_idx, dtype=np.float64)
+        np.divide(t, r, out=t)
+        t += t0 - d
+        return np.ma.asarray(t)
  
     def get_xyz_timestamp(cls, xyzIndex):
-        t0 = cls.get_var('xyzStartTime')[0]
-        r = cls.get_var('xyzSampleRate')[0]
-        # Mark I will have filter delay set to fill value
-        d = cls.get_var('xyzFilterDelay')
-        d = 0 if d[0] is np.ma.masked else d[0]
+        t0, r, d = cls.get_xyz_meta()
         if t0 and r and d >= 0:
             return t0 - d + xyzIndex/r
         else:
@@ -689,7 +854,7 @@ class Archive(CDIPnc):
         xyzTime = cls.make_xyzTime(start_idx, end_idx)
         result = { 'xyzTime': xyzTime }
         for vname in cls.vrs:
-            result[vname] = cls.get_var(vname)[start_idx:end_idx]
+            result[vname] = cls.make_masked_array(cls.get_var(vname), start_idx, end_idx)
         return result
 
 class RealtimeXY(Archive):
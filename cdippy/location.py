@@ -1,96 +1,152 @@
-from math import radians, sin, cos, sqrt, asin, atan2, degrees
+from math import radians, sin, cos, atan2, degrees, fabs, sqrt
+
+import numpy as np
+
+#- The numba batch kernel is imported where it is used, as importing numba is slow
+
+def central_angle(rlat1, rlon1, rlat2, rlon2):
+    """ Returns the central angle (radians) between two points given in radians. """
+    a = sin((rlat2-rlat1)/2)**2 + cos(rlat1)*cos(rlat2)*sin((rlon2-rlon1)/2)**2
+    return 2*atan2(sqrt(a), sqrt(1.0-a))
+
+def central_angles(rlats, rlons, rlat0, rlon0):
+    """ Returns the central angles between rlats, rlons and rlat0, rlon0 (radians), with numpy broadcasting. """
+    a = np.sin((rlats-rlat0)/2)**2 + np.cos(rlat0)*np.cos(rlats)*np.sin((rlons-rlon0)/2)**2
+    return 2*np.arctan2(np.sqrt(a), np.sqrt(1.0-a))
 
 class Location:
 
     """ A class to work with latitude/longitude locations """
 
+    __slots__ = ('_latitude', '_longitude', '_rlat', '_rlon', '_coslat', '_sinlat')
+
     R = 6372.8 # Earth radius in kilometers
     kmToNm = .539957 #1KM ==  .539957 NM
 
-    def __init__(cls, latitude, longitude):
-        cls.latitude = latitude
-        cls.longitude = longitude
-
-    def write_lat(cls):
-        return repr(cls.latitude)+" N"
-
-    def write_lon(cls):
-        return repr(cls.longitude)
-
-    def write_loc(cls):
-        return cls.write_lat()+" "+cls.write_lon()
-
-    def decimalMin_Loc(cls):
-        longitude = cls.longitude
-        if (longitude < 0):
-            longitude  = longitude  * -1
-        dmLon = divmod(longitude, 1)
-        minLon = dmLon[1]
-        minLon = minLon * 60
-        minLon = format(minLon,'2.3f')
-        latitude = cls.latitude
-        if (latitude < 0):
-            latitude  = latitude  * -1
-        dmLat = divmod(latitude, 1)
-        minLat = dmLat[1]
-        minLat = minLat * 60
-        minLat = format(minLat,'2.3f')
-
-        if (cls.longitude < 0):
-            dLon  = dmLon[0] * -1
-            dLon = int(dLon)
-        else:
-            dLon  = dmLon[0]
-            dLon = int(dLon)
-
-        if (cls.latitude < 0):
-            dLat  = dmLat[0] * -1
-            dLat = int(dLat)
-        else:
-            dLat  = dmLat[0]
-            dLat = int(dLat)
+    def __init__(self, latitude, longitude):
+        self.latitude = latitude
+        self.longitude = longitude
+
+    # Setting latitude or longitude recomputes the radians and trig values
+    # reused by get_distance and get_direction
+
+    @property
+    def latitude(self):
+        return self._latitude
+
+    @latitude.setter
+    def latitude(self, latitude):
+        self._latitude = latitude
+        self._rlat = radians(latitude)
+        self._coslat = cos(self._rlat)
+        self._sinlat = sin(self._rlat)
 
+    @property
+    def longitude(self):
+        return self._longitude
+
+    @longitude.setter
+    def longitude(self, longitude):
+        self._longitude = longitude
+        self._rlon = radians(longitude)
+
+    def write_lat(self):
+        return repr(self.latitude)+" N"
+
+    def write_lon(self):
+        return repr(self.longitude)
+
+    def write_loc(self):
+        return self.write_lat()+" "+self.write_lon()
+
+    def decimalMin_Loc(self):
+        def dm(x):
+            # Signed whole degrees and unsigned decimal minutes
+            ax = fabs(x)
+            d = int(ax)
+            return (-d if x < 0 else d), format((ax - d) * 60, '2.3f')
+
+        dLon, minLon = dm(self.longitude)
+        dLat, minLat = dm(self.latitude)
         return {'dlon':dLon,'mlon':minLon,'dlat':dLat,'mlat':minLat}
 
 
-    def get_distance(cls, loc):
+    def get_distance(self, loc):
         """
         Return the distance in nautical miles after calculating the distance between
-        two different geographical location
+        two different geographical location. Uses the atan2 form of the Haversine,
+        which keeps its precision for nearly antipodal points.
         """
-        rdn_longitude, rdn_latitude, loc.longitude, loc.latitude = map(radians, [cls.longitude, cls.latitude, loc.longitude, loc.latitude ])
+        c = central_angle(self._rlat, self._rlon, loc._rlat, loc._rlon)
+        return  (self.R * c * self.kmToNm)
 
-        dLat = loc.latitude - rdn_latitude
-        dLon = loc.longitude - rdn_longitude
-
-        a = sin(dLat/2)**2 + cos(rdn_latitude)*cos(loc.latitude )*sin(dLon/2)**2
-        c = 2*asin(sqrt(a))
-        return  (cls.R * c * cls.kmToNm)
+    def get_distances(self, lats, lons):
+        """
+        Return an array of distances in nautical miles from this location to each of
+        the points given by the arrays lats, lons (in degrees)
+        """
+        lats, lons = np.asarray(lats, dtype=float), np.asarray(lons, dtype=float)
+        if lats.ndim != 1 or lats.shape != lons.shape:
+            return Location.haversine_vec(self.latitude, self.longitude, lats, lons)
+        from cdippy._geo_kernels import central_angle_batch
+        c = central_angle_batch(np.radians(lats), np.radians(lons), self._rlat, self._rlon)
+        return self.R * c * self.kmToNm
+
+    @staticmethod
+    def haversine_vec(lat1, lon1, lat2, lon2):
+        """
+        Vectorized get_distance: returns the distances in nautical miles between points 1 and 2,
+        with the usual numpy broadcasting. E.g. lat1[:,None], lon1[:,None], lat2, lon2 gives the 
+        pairwise distance matrix.
+        """
+        c = central_angles(np.radians(lat2), np.radians(lon2), np.radians(lat1), np.radians(lon1))
+        return Location.R * c * Location.kmToNm
 
-    def get_distance_formatted(cls, loc):
+    def get_distance_formatted(self, loc):
         """
         Return the distance in nautical miles formatted to two decimal places, after calculating the distance between
         two different geographical location
         """
-        return (format(cls.get_distance(loc), '.2f'))
+        return (format(self.get_distance(loc), '.2f'))
 
-    def get_direction(cls, loc):
+    def get_direction(self, loc):
         """
         The formulae used is the following:
         θ = atan2(sin(Δlong).cos(lat2),
                   cos(lat1).sin(lat2) − sin(lat1).cos(lat2).cos(Δlong))
         returns angle in degrees
         """
-        rdn_longitude, rdn_latitude, loc.longitude, loc.latitude = map(radians, [cls.longitude, cls.latitude, loc.longitude, loc.latitude ])
-
-        dLon = loc.longitude  - rdn_longitude
-        x = sin(dLon)*cos(loc.latitude)
-        y = cos(rdn_latitude)*sin(loc.latitude) - sin(rdn_latitude)*cos(loc.latitude)*cos(dLon)
+        dLon = loc._rlon - self._rlon
+        x = sin(dLon)*loc._coslat
+        y = self._coslat*loc._sinlat - self._sinlat*loc._coslat*cos(dLon)
         direction = atan2(x, y)
         direction = degrees (direction)
         direction = (direction + 360 ) % 360
         return direction
 
+class LocationArray:
+
+    """ Latitudes/longitudes of many Locations packed into arrays, for bulk distance queries """
+
+    __slots__ = ('lats', 'lons', '_rlat', '_rlon')
+
+    def __init__(self, locations):
+        self.lats = np.fromiter((l.latitude for l in locations), dtype=np.float64)
+        self.lons = np.fromiter((l.longitude for l in locations), dtype=np.float64)
+        self._rlat = np.radians(self.lats)
+        self._rlon = np.radians(self.lons)
+
+    def __len__(self):
+        return len(self.lats)
+
+    def distances_from(self, lat, lon):
+        """
+        Return an array of the distances in nautical miles from lat, lon to each location
+        """
+        from cdippy._geo_kernels import central_angle_batch
+        c = central_angle_batch(self._rlat, self._rlon, radians(lat), radians(lon))
+        return Location.R * c * Location.kmToNm
+
 if __name__ == "__main__":
 
     #- Tests
@@ -4,13 +4,16 @@ def getRealtimeStations():
     """ Get a list of realtime stations available from CDIP's thredds catalog"""
     from lxml import etree
     from urllib.request import urlopen
-    parser = etree.HTMLParser()
-    with urlopen('http://thredds.cdip.ucsd.edu/thredds/catalog/cdip/realtime/catalog.xml') as f:
-        tree = etree.parse(f, parser)
-    root = tree.getroot()
     stations = []
-    for dataset in root.iterfind('.//dataset/dataset'):
-        stations.append(dataset.get('name')[0:3])
+    with urlopen('http://thredds.cdip.ucsd.edu/thredds/catalog/cdip/realtime/catalog.xml') as f:
+        #- Stream the catalog, keeping only the element being parsed in memory
+        for _, el in etree.iterparse(f, events=('end',), tag='{*}dataset'):
+            parent = el.getparent()
+            if parent is not None and etree.QName(parent).localname == 'dataset':
+                stations.append(el.get('name')[0:3])
+                el.clear()
+                while el.getprevious() is not None:
+                    del parent[0]
     return(stations)
 
 
@@ -1,43 +1,54 @@
+import time
+
 import cdippy.url_utils as uu
 import cdippy.utils as cu
 
+#- Parsed hash tables by url, shared by NcHashes instances: {url: (load time, hashes)}
+_hash_cache = {}
+
 class NcHashes():
     """ Methods for working with the online list of historic nc file hashes """
 
     hashes_url = 'http://cdip.ucsd.edu/data_access/metadata/wavecdf_by_datemod.txt'
-    new_hashes = {}
     hash_pkl = 'HASH.pkl'
+    hash_ttl = 300 # Seconds a downloaded hash table is reused for
 
     def __init__(cls):
+        cls.new_hashes = {}
+        cls.last_deployments = {}
         cls.load_hash_table()
 
     def load_hash_table(cls):
-        lines = uu.read_url(cls.hashes_url).strip().split('\n')
-        for line in lines:
-            if line[0:8] == 'filename':
-                continue
-            fields = line.split('\t')
-            cls.new_hashes[fields[0]] = fields[6]
+        cached = _hash_cache.get(cls.hashes_url)
+        if cached is None or time.time() - cached[0] >= cls.hash_ttl:
+            text = uu.read_url(cls.hashes_url)
+            if text is None:
+                return
+            hashes = {}
+            for line in text.strip().split('\n'):
+                if line.startswith('filename'):
+                    continue
+                fields = line.split('\t')
+                hashes[fields[0]] = fields[6]
+            cached = (time.time(), hashes)
+            _hash_cache[cls.hashes_url] = cached
+        cls.new_hashes = dict(cached[1])
+        #- Index the last deployment of each station, e.g. {'100p1': 'd05'}
+        cls.last_deployments = {}
+        for name in cls.new_hashes:
+            if name[5:7] == '_d':
+                stn = name[0:5]
+                cls.last_deployments[stn] = max(cls.last_deployments.get(stn, 'd00'), name[6:9])
 
     def get_last_deployment(cls, stn):
-        last_deployment = 'd00'
-        for name in cls.new_hashes:
-            print(name[6:9]) 
-            if name[0:5] == stn and name[5:7] == '_d' and last_deployment < name[6:9]:
-                    last_deployment = name[6:9] 
-        return last_deployment
+        return cls.last_deployments.get(stn, 'd00')
          
     def compare_hash_tables(cls):
         """ Return a list of nc files that have changed or are new """
         old_hashes = cls.get_old_hashes()
-        changed = []
-        if old_hashes :
-            if len(cls.new_hashes) == 0:
-                cls.load_hash_table()
-            for key in cls.new_hashes:
-                if key not in old_hashes.keys() or (key in old_hashes.keys() and old_hashes[key] != cls.new_hashes[key]):
-                    changed.append(key)
-        return changed
+        if not old_hashes:
+            return []
+        return [key for key, new_hash in cls.new_hashes.items() if old_hashes.get(key) != new_hash]
 
     def save_new_hashes(cls):
         cu.pkl_dump(cls.new_hashes,cls.hash_pkl)
@@ -81,12 +81,23 @@ class NcStats(StnData):
         result = {'totals':{},'by_month':{}}
         if not flags:
             flags = cls.flags
+        #- Look up each flag's prefix, values and meanings once
+        meta = {}
         for flag_name in flags:
-            dim = cls.meta.get_var_prefix(flag_name)
-            cls.data = cls.get_series(cls.start, cls.end, [flag_name], cls.pub_set)
-            cat_var = cls.make_categorical_flag_var(flag_name)
-            result['totals'][flag_name] = cls.total_count(cat_var)
-            result['by_month'][flag_name] = cls.by_month_count(cat_var, dim)
+            meta[flag_name] = (cls.meta.get_var_prefix(flag_name), 
+                cls.meta.get_flag_values(flag_name), cls.meta.get_flag_meanings(flag_name))
+        #- Flags with the same prefix share a time dimension, so read them with one get_series
+        by_dim = {}
+        for flag_name in flags:
+            by_dim.setdefault(meta[flag_name][0], []).append(flag_name)
+        result['totals'] = dict.fromkeys(flags)
+        result['by_month'] = dict.fromkeys(flags)
+        for dim, flag_names in by_dim.items():
+            cls.data = cls.get_series(cls.start, cls.end, flag_names, cls.pub_set)
+            for flag_name in flag_names:
+                cat_var = cls.make_categorical_flag_var(flag_name, *meta[flag_name][1:])
+                result['totals'][flag_name] = cls.total_count(cat_var)
+                result['by_month'][flag_name] = cls.by_month_count(cat_var, dim)
         return result
         
     def total_count(cls, cat_var):
@@ -95,13 +106,20 @@ class NcStats(StnData):
 
     def by_month_count(cls, cat_var, dim):
         """ Returns pandas dataframe of Counts by month for a given flag variable. """
-        df = pd.DataFrame({'cnt':cat_var},index=pd.to_datetime(cls.data[dim+'Time'],unit='s'))
-        mon_map = df.index.map(lambda x: str(x.year)+str('{:02d}'.format(x.month)))
-        return df.groupby([mon_map,cat_var]).count().fillna(0).astype(int)
-
-    def make_categorical_flag_var(cls, flag_name):
-        cat = pd.Categorical(cls.data[flag_name], categories=cls.meta.get_flag_values(flag_name))
-        return cat.rename_categories(cls.meta.get_flag_meanings(flag_name))
+        idx = pd.to_datetime(cls.data[dim+'Time'],unit='s')
+        df = pd.DataFrame({'cnt':cat_var},index=idx)
+        # Group on an int yyyymm key, then label just the unique months as strings, e.g. '201607'
+        mon_map = idx.year.values*100 + idx.month.values
+        counts = df.groupby([mon_map,cat_var]).count().fillna(0).astype(int)
+        return counts.rename(index=str, level=0)
+
+    def make_categorical_flag_var(cls, flag_name, flag_values=None, flag_meanings=None):
+        if flag_values is None:
+            flag_values = cls.meta.get_flag_values(flag_name)
+        if flag_meanings is None:
+            flag_meanings = cls.meta.get_flag_meanings(flag_name)
+        cat = pd.Categorical(cls.data[flag_name], categories=flag_values)
+        return cat.rename_categories(flag_meanings)
 
 
 if __name__ == "__main__":
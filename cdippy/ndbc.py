@@ -1,7 +1,7 @@
 """ Methods for working with NDBC """
 
 import os
-from datetime import datetime
+import time
 
 import cdippy.url_utils as uu
 import cdippy.utils as cu
@@ -14,6 +14,7 @@ outputformat = 'outputformat=text/xml;subtype="sensorML/1.0.1"'
 describe_stn = 'procedure=urn:ioos:station:wmo:'
 
 cdip_base = 'http://cdip.ucsd.edu'
+wmo_ids_ttl = 86400 # Seconds before get_wmo_id downloads the wmo id table again
 
 def get_stn_info(wmo_id):
     """ Work in progress, querying ndbc sos service. """
@@ -23,20 +24,32 @@ def get_stn_info(wmo_id):
     results = []
     uu.rfindt(root, results, 'description')
 
+def _remove(fl):
+    try:
+        os.remove(fl)
+    except OSError:
+        pass
+
 def get_wmo_id(stn):
     """ Queries cdip wmo id table for a given station. Drops pickle file locally.  """
     pkl_fl = './WMO_IDS.pkl'
-    now = datetime.utcnow()
-    if now.minute == 23 or not os.path.isfile(pkl_fl):
+    ids = None
+    needs_refresh = not os.path.isfile(pkl_fl) or time.time() - os.path.getmtime(pkl_fl) > wmo_ids_ttl
+    if needs_refresh:
         url = '/'.join([cdip_base,'wmo_ids']) 
         r = uu.read_url(url)
-        ids = {}
-        for line in r.splitlines():
-            ids[line[0:3]] = line[5:].strip()
-        cu.pkl_dump(ids,pkl_fl)
-    else:  
+        if r is not None:
+            ids = {line[0:3]: line[5:].strip() for line in r.splitlines()}
+            # Write a temp file then rename, so readers never see a partial pickle
+            tmp_fl = pkl_fl+'.tmp'
+            _remove(tmp_fl) # Left by an earlier failed run
+            if cu.pkl_dump(ids,tmp_fl):
+                os.replace(tmp_fl, pkl_fl)
+            else:
+                _remove(tmp_fl)
+    if ids is None:
         ids = cu.pkl_load(pkl_fl)
-    if stn in ids:
+    if ids and stn in ids:
         return ids[stn]
 
 if __name__ == "__main__":
@@ -1,6 +1,7 @@
+from collections import defaultdict
 from datetime import datetime, timedelta
-from bisect import bisect_left
 
+import numpy as np
 import numpy.ma as ma
 
 from cdippy.cdippy import CDIPnc, Archive, Realtime, RealtimeXY, Historic
@@ -19,6 +20,7 @@ class StnData(CDIPnc):
     """
 
     max_deployments = 99 # Checks at most this number of deployment nc files
+    archive_probe_batch = 8 # Remote deployment urls checked in parallel at a time, see get_archive
 
     # Commonly requested sets of variables
     parameter_vars = ['waveHs', 'waveTp', 'waveDp', 'waveTa']
@@ -44,15 +46,35 @@ class StnData(CDIPnc):
         cls.stn = stn
         cls.data_dir = data_dir
         cls.org = org
-        cls.historic = Historic(cls.stn, cls.data_dir, cls.org)
-        cls.realtime = Realtime(cls.stn, cls.data_dir, cls.org)
-        if cls.historic and cls.historic.nc :
-            cls.meta = cls.historic
-        else: 
-            if cls.realtime and cls.realtime.nc :
-                cls.meta = cls.realtime
-            else:
-                return None
+        cls._archive_cache = {} # Archive objects (or None) by deployment, see get_archive
+        cls._probed_deps = set()
+        cls._realtime_xy = None
+        cls._historic = None # Historic and Realtime are opened on first use
+        cls._realtime = None
+        cls._time_cache = {} # Time variable arrays by (filename, time_var), see get_stamps
+
+    @property
+    def historic(cls):
+        """ The station's Historic file. """
+        if cls._historic is None:
+            cls._historic = Historic(cls.stn, cls.data_dir, cls.org)
+        return cls._historic
+
+    @property
+    def realtime(cls):
+        """ The station's Realtime file. """
+        if cls._realtime is None:
+            cls._realtime = Realtime(cls.stn, cls.data_dir, cls.org)
+        return cls._realtime
+
+    @property
+    def meta(cls):
+        """ The file metadata is read from: historic if it exists, otherwise realtime (or None). """
+        if cls.historic.nc is not None:
+            return cls.historic
+        if cls.realtime.nc is not None:
+            return cls.realtime
+        return None
 
     def get_parameters(cls, start=None, end=None, pub_set='public', apply_mask=True, target_records=0):
         return cls.get_series(start, end, cls.parameter_vars, pub_set, apply_mask, target_records)
@@ -123,18 +145,19 @@ class StnData(CDIPnc):
         if cls.vrs and cls.vrs[0] == 'xyzData':
             cls.vrs = ['xyzXDisplacement','xyzYDisplacement','xyzZDisplacement']
         request_timespan = cu.Timespan(cls.start_stamp, cls.end_stamp)
-        result = {}
+        # Each file's arrays are collected per variable and concatenated once at the end
+        chunks = defaultdict(list)
 
-        def helper(cdip_nc, request_timespan, result):
+        def helper(cdip_nc, request_timespan):
             # Try the next file if it is without xyz data
             z = cdip_nc.get_var('xyzZDisplacement')
             if z is None:
-                return result, cls.start_stamp
+                return cls.start_stamp
             # Try the next file if start_stamp cannot be calculated
             start_stamp = cdip_nc.get_xyz_timestamp(0)
             end_stamp = cdip_nc.get_xyz_timestamp(len(z)-1)
             if start_stamp is None:
-                return result, cls.start_stamp
+                return cls.start_stamp
             file_timespan = cu.Timespan(start_stamp, end_stamp)
             # Add data if request timespan overlaps data timespan
             if request_timespan.overlap(file_timespan):
@@ -143,32 +166,36 @@ class StnData(CDIPnc):
                 cdip_nc.pub_set = cls.pub_set
                 cdip_nc.apply_mask = cls.apply_mask
                 cdip_nc.vrs = cls.vrs
-                tmp_result = cdip_nc.get_request()
-                result = cls.aggregate_dicts(result, tmp_result)
-            return result, start_stamp
+                for key, arr in cdip_nc.get_request().items():
+                    chunks[key].append(arr)
+            return start_stamp
+
+        def merged():
+            return {key: ma.concatenate(v) if len(v) > 1 else v[0] for key, v in chunks.items()}
 
         # First get realtime data if it exists
-        rt = RealtimeXY(cls.stn)
+        start_stamp = None
+        rt = cls.get_realtime_xy()
         if rt.nc is not None:
-            result, start_stamp = helper(rt, request_timespan, result)
+            start_stamp = helper(rt, request_timespan)
 
         # If the request start time is more recent than the realtime
         # start time, no need to look in the archives
-        if cls.start_stamp > start_stamp:
-            return result
+        if start_stamp is not None and cls.start_stamp > start_stamp:
+            return merged()
 
         # Second, look in archive files for data
         for dep in range(1, cls.max_deployments):
             deployment = 'd'+'{:02d}'.format(dep)
-            ar = Archive(cls.stn, deployment, cls.data_dir, cls.org)
-            if ar.nc is None:
+            ar = cls.get_archive(deployment)
+            if ar is None:
                 break
-            result, start_stamp = helper(ar, request_timespan, result)
+            start_stamp = helper(ar, request_timespan)
             
             # Break if file start stamp is greater than request end stamp
             if start_stamp > cls.end_stamp :
                 break
-        return result
+        return merged()
 
     def merge_request(cls):
         """ Returns data for given request across realtime and historic files """
@@ -193,27 +220,62 @@ class StnData(CDIPnc):
             ht = h.get_request()
         return cls.aggregate_dicts(ht, rt)
 
+    def get_archive(cls, deployment):
+        """ Returns the Archive for deployment (e.g. 'd01'), or None if it has no nc file. Opened once per instance. """
+        if deployment not in cls._archive_cache:
+            if cls.data_dir is None:
+                if deployment not in cls._probed_deps:
+                    cls.probe_archives(int(deployment[1:]))
+                org = cls.org if cls.org else 'cdip'
+                if cls.url_missing(cls.make_dataset_url(cls.stn, org, 'archive', deployment)[1]):
+                    cls._archive_cache[deployment] = None
+                    return None
+            ar = Archive(cls.stn, deployment, cls.data_dir, cls.org)
+            cls._archive_cache[deployment] = ar if ar.nc is not None else None
+        return cls._archive_cache[deployment]
+
+    def probe_archives(cls, first_dep):
+        """ Checks the next archive_probe_batch remote deployment urls, starting at first_dep, in parallel. """
+        deps = ['d'+'{:02d}'.format(dep) for dep in range(first_dep, min(first_dep+cls.archive_probe_batch, cls.max_deployments))]
+        org = cls.org if cls.org else 'cdip'
+        urls = [cls.make_dataset_url(cls.stn, org, 'archive', dep)[1] for dep in deps]
+        cls.probe_urls(urls, cls.archive_probe_batch)
+        cls._probed_deps.update(deps)
+
+    def get_realtime_xy(cls):
+        """ Returns the station's RealtimeXY, opened on first use. """
+        if cls._realtime_xy is None:
+            cls._realtime_xy = RealtimeXY(cls.stn, cls.data_dir, cls.org)
+        return cls._realtime_xy
+
     def get_nc_files(cls, types=['realtime','historic','archive']):
         """ Returns dict of netcdf4 objects of a station's netcdf files """
         result = {}
         for type in types:
             if type == 'realtime':
-                rt = Realtime(cls.stn, cls.data_dir, cls.org)
+                rt = cls.realtime
                 if rt.nc:
                     result[rt.filename] = rt.nc
             if type == 'historic':
-                ht = Historic(cls.stn, cls.data_dir, cls.org)
+                ht = cls.historic
                 if ht.nc:
                     result[ht.filename] = ht.nc
             if type == 'archive':
                 for dep in range(1,cls.max_deployments):
                     deployment = 'd'+'{:02d}'.format(dep)
-                    ar = Archive(cls.stn, deployment, cls.data_dir, cls.org)
-                    if ar.nc is None:
+                    ar = cls.get_archive(deployment)
+                    if ar is None:
                         break
                     result[ar.filename] = ar
         return result
 
+    def get_stamps(cls, cdip_nc, time_var):
+        """ Returns the time_var array of cdip_nc (e.g. cls.realtime), read once per instance. """
+        key = (cdip_nc.filename, time_var)
+        if key not in cls._time_cache:
+            cls._time_cache[key] = cdip_nc.get_var(time_var)[:]
+        return cls._time_cache[key]
+
     def get_target_timespan(cls, target_timestamp, n, time_var):
         """ 
             Returns a 2-tuple of timestamps, an interval corresponding to  n records to 
@@ -235,9 +297,9 @@ class StnData(CDIPnc):
 
         r_closest_idx = None
         if r_ok: 
-            r_stamps = cls.realtime.get_var(time_var)[:] 
+            r_stamps = cls.get_stamps(cls.realtime, time_var)
             r_last_idx = len(r_stamps) - 1
-            i_b = bisect_left(r_stamps, target_timestamp)
+            i_b = int(np.searchsorted(r_stamps, target_timestamp, side='left'))
             # i_b will be possibly one more than the last index
             i_b = min(i_b, r_last_idx)
             # Target timestamp is exactly equal to a data time 
@@ -251,9 +313,9 @@ class StnData(CDIPnc):
         h_closest_idx = None
         h_last_idx = None # Let's us know if h_stamps has been loaded
         if h_ok and not r_closest_idx:
-            h_stamps = cls.historic.get_var(time_var)[:] 
+            h_stamps = cls.get_stamps(cls.historic, time_var)
             h_last_idx = len(h_stamps) - 1
-            i_b = bisect_left(h_stamps, target_timestamp)
+            i_b = int(np.searchsorted(h_stamps, target_timestamp, side='left'))
             i_b = min(i_b, h_last_idx)
             # Target timestamp is exactly equal to a data time 
             if (i_b <= h_last_idx and h_stamps[i_b] == target_timestamp) or i_b == 0:
@@ -276,7 +338,7 @@ class StnData(CDIPnc):
             # If bound exceeded toward H and H exists, cacluate h_interval
             if r_interval[2] < 0 and h_ok:
                 if not h_last_idx:
-                    h_stamps = cls.historic.get_var(time_var)[:] 
+                    h_stamps = cls.get_stamps(cls.historic, time_var)
                     h_last_idx = len(h_stamps) - 1
                 h_interval = tsu.get_interval(h_stamps, h_last_idx, n+r_closest_idx+1)
                 #print("Rx H interval: ", h_interval)
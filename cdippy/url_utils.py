@@ -1,26 +1,20 @@
 """ Methods for working with urllib scraping web pages """
 
+import gzip
 import xml.etree.ElementTree as ET
+import urllib.error
 import urllib.request
 
+#- Earlier responses by url, revalidated with a conditional GET: {url: (etag, last_modified, body)}
+_response_cache = {}
+
 def rfindta(el, r, tag, attr):
-    """ Recursively find tags with value tag and attribute attr and append to list r """
-    if len(el) > 0:
-        for c in el:
-            rfindta(c, r, tag, attr)
-    if el.tag.find(tag) >= 0:
-        for child in el.attrib:
-            if child.find(attr) >= 0:
-                r.append(el.attrib[child])
+    """ Find tags (in el and below) with value tag and attribute attr and append their values to list r """
+    r.extend(v for e in el.iter() if tag in e.tag for k, v in e.attrib.items() if attr in k)
 
 def rfindt(el, r, tag):
-    """ Recursively find tags with value tag append to list r """
-    if len(el) > 0:
-        for c in el:
-            rfindt(c, r, tag)
-    if el.tag.find(tag) >= 0:
-        print(el.text)
-        r.append(el.text)
+    """ Find tags (in el and below) with value tag and append their text to list r """
+    r.extend(e.text for e in el.iter() if tag in e.tag)
 
 def url_exists(url):
     req = urllib.request.Request(url)
@@ -31,12 +25,36 @@ def url_exists(url):
     else:
         return True
 
+def fetch_url(url, timeout=30):
+    """ Returns the body of url as bytes. A cached copy is revalidated with ETag/If-Modified-Since. """
+    headers = {'Accept-Encoding': 'gzip'}
+    cached = _response_cache.get(url)
+    if cached:
+        if cached[0]:
+            headers['If-None-Match'] = cached[0]
+        if cached[1]:
+            headers['If-Modified-Since'] = cached[1]
+    req = urllib.request.Request(url, headers=headers)
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            body = resp.read()
+            if resp.headers.get('Content-Encoding') == 'gzip':
+                body = gzip.decompress(body)
+            etag, modified = resp.headers.get('ETag'), resp.headers.get('Last-Modified')
+    except urllib.error.HTTPError as e:
+        if e.code == 304 and cached: # Not modified
+            return cached[2]
+        raise
+    if etag or modified:
+        _response_cache[url] = (etag, modified, body)
+    return body
+
 def read_url(url):
     try:
-        r = urllib.request.urlopen(url).read().decode('UTF-8')
+        r = fetch_url(url).decode('UTF-8')
     except:
         return None
     return r
 
 def load_et_root(url):
-    return ET.fromstring(urllib.request.urlopen(url).read())
+    return ET.fromstring(fetch_url(url))
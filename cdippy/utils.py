@@ -1,94 +1,280 @@
-import os, errno
+import os
 import pickle as pkl
-import time
-from datetime import datetime
-import pytz
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
 import calendar as cal
 
+try:
+    from typing import final
+except ImportError: # Python < 3.8
+    def final(c):
+        return c
+
+try:
+    from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+except ImportError: # Python < 3.9
+    ZoneInfo = None
+
+import numpy as np
+
+_UTC = timezone.utc
+_EPOCH = datetime(1970, 1, 1)
+
 # File utils
 
 def mkdir_p(path):
-    try:
-        os.makedirs(path)
-    except OSError as exc:  # Python >= 2.5
-        if exc.errno == errno.EEXIST and os.path.isdir(path):
-            pass
-        else: raise
+    os.makedirs(path, exist_ok=True)
 
-def cdip_open(path,mode='w',buffer_bytes=4096):
-    dir = os.path.dirname(path)
-    if mode == 'w' or mode == 'a' :
+#- Directories cdip_open has already made sure exist
+_ensured_dirs = set()
+_ensured_dirs_lock = threading.Lock()
+_ensured_dirs_max = 10000
+
+def _ensure_dir(dir):
+    if dir and dir not in _ensured_dirs:
         mkdir_p(dir)
+        with _ensured_dirs_lock:
+            if len(_ensured_dirs) >= _ensured_dirs_max:
+                _ensured_dirs.clear()
+            _ensured_dirs.add(dir)
+
+#- File system block size of each directory cdip_open has opened files in
+_blksizes = {}
+
+def _dir_blksize(dir):
+    blksize = _blksizes.get(dir)
+    if blksize is None:
+        try:
+            blksize = getattr(os.stat(dir or '.'), 'st_blksize', 0)
+        except OSError:
+            blksize = 0
+        with _ensured_dirs_lock:
+            if len(_blksizes) >= _ensured_dirs_max:
+                _blksizes.clear()
+            _blksizes[dir] = blksize
+    return blksize
+
+def cdip_open(path,mode='w',buffer_bytes=65536):
+    """ Opens path, making its directory for 'w' and 'a'. Buffers at least buffer_bytes or one file system block. """
+    dir = os.path.dirname(path)
+    if mode == 'w' or mode == 'a':
+        _ensure_dir(dir)
     try:
-        f = open(path,mode,buffer_bytes)
-    except Exception:
+        f = open(path,mode,buffering=max(buffer_bytes, _dir_blksize(dir), 1))
+    except OSError:
+        _ensured_dirs.discard(dir) # In case it was removed since
+        _blksizes.pop(dir, None)
         return None
     else:
         return f
 
 # Pickle utils
 
-def pkl_load(fl):
+pkl_buffer_bytes = 1 << 20 # File buffer for pkl_load/pkl_dump, so pickling does few large reads/writes
+
+#- Out-of-band pickle files are laid out as a pickled list of buffer lengths, the raw buffers
+#- back to back, then the protocol 5 pickle that refers to them in order. Only the small
+#- in-band pickle is held in memory; the buffers are written from the objects' own memory.
+
+def pkl_load(fl, out_of_band=False):
+    """ Loads a pickle file, out_of_band must match the pkl_dump call that wrote it. """
     try:
-        with open(fl, 'rb') as f:
-            return pkl.load(f)
-    except:
+        with open(fl, 'rb', buffering=pkl_buffer_bytes) as f:
+            if not out_of_band:
+                return pkl.Unpickler(f).load()
+            #- Buffer lengths, the raw buffers, then the pickle that refers to them
+            lengths = pkl.load(f)
+            if not isinstance(lengths, list) or not all(type(n) is int for n in lengths):
+                return None # Not an out_of_band file
+            buffers = []
+            for n in lengths:
+                b = bytearray(n) # Writable, so numpy arrays come back writable
+                if f.readinto(b) != n:
+                    return None # Truncated
+                buffers.append(b)
+            return pkl.Unpickler(f, buffers=buffers).load()
+    except (OSError, pkl.PickleError, EOFError):
         return None
 
-def pkl_dump(obj,fl):
+def pkl_dump(obj, fl, out_of_band=False):
+    """ 
+        Pickles obj to file fl, returning True if the whole pickle was written. With out_of_band, large
+        buffers (e.g. numpy arrays) are written straight to the file with pickle protocol 5 instead of
+        being copied into the pickle bytes.
+    """
     try:
-        with open(fl, 'wb') as f:
-            pkl.dump(obj, f, -1)
-    except:
-        pass
+        with open(fl, 'wb', buffering=pkl_buffer_bytes) as f:
+            if not out_of_band:
+                pkl.Pickler(f, -1).dump(obj)
+                return True
+            buffers = []
+            data = pkl.dumps(obj, protocol=5, buffer_callback=buffers.append)
+            raws = [b.raw() for b in buffers]
+            pkl.Pickler(f, protocol=5).dump([r.nbytes for r in raws])
+            for r in raws:
+                f.write(r)
+            f.write(data)
+    except (OSError, pkl.PickleError):
+        return False
+    return True
+
+def pkl_dump_many(pairs, out_of_band=False, max_workers=8):
+    """ Pkl_dump for a sequence of (obj, fl) pairs, overlapping the writes in threads. Returns a success flag per pair. """
+    with ThreadPoolExecutor(max_workers=max_workers) as ex:
+        return list(ex.map(lambda pair: pkl_dump(pair[0], pair[1], out_of_band), pairs))
 
 # Time utils
 
 def cdip_datestring(datetime_obj):
-    return datetime_obj.strftime('%Y%m%d%H%M%S')
+    """ Returns the yyyymmddHHMMSS string for a datetime. """
+    return '%04d%02d%02d%02d%02d%02d' % (datetime_obj.year, datetime_obj.month, datetime_obj.day,
+        datetime_obj.hour, datetime_obj.minute, datetime_obj.second)
 
-def cdip_datetime(cdip_str):
+def _py_cdip_datetime(cdip_str):
+    """ Returns the datetime for a yyyy[mm[dd[HH[MM[SS]]]]] string, or None if it is not valid. """
     l = len(cdip_str)
-    if l > 14 or l < 4 or l % 2 != 0:
+    #- Non-ascii digits sort after '9'
+    if l > 14 or l < 4 or l % 2 != 0 or not cdip_str.isdigit() or max(cdip_str) > '9':
+        return None
+    try:
+        y = int(cdip_str[0:4])
+        mo = int(cdip_str[4:6]) if l >= 6 else 1
+        d = int(cdip_str[6:8]) if l >= 8 else 1
+        h = int(cdip_str[8:10]) if l >= 10 else 0
+        mi = int(cdip_str[10:12]) if l >= 12 else 0
+        s = int(cdip_str[12:14]) if l >= 14 else 0
+        return datetime(y, mo, d, h, mi, s)
+    except ValueError:
         return None
-    full_fmt = ['%Y','%m','%d','%H','%M','%S']
-    ixs = [ 14, 12, 10, 8, 6, 4 ]
-    cnt = 6
-    for ix in ixs:
-        if l >= ix:
-            return datetime.strptime(cdip_str,''.join(full_fmt[0:cnt]))
-        cnt -= 1
-    return None
+
+try:
+    from cdippy._utils import cdip_datetime as _cdip_datetime
+except ImportError:
+    _cdip_datetime = None
+
+#- Memoized, with the compiled parser when it has been built
+cdip_datetime = lru_cache(maxsize=4096)(_cdip_datetime or _py_cdip_datetime)
+
+def cdip_datestrings(dts):
+    """ Array version of cdip_datestring: returns an array of yyyymmddHHMMSS strings. """
+    iso = np.asarray(dts, dtype='datetime64[s]').astype(str) # yyyy-mm-ddTHH:MM:SS
+    return np.char.replace(np.char.replace(np.char.replace(iso, '-', ''), ':', ''), 'T', '')
+
+def cdip_datetimes(cdip_strs):
+    """ Array version of cdip_datetime: returns a datetime64[s] array, NaT where a string is not valid. """
+    cdip_strs = list(cdip_strs)
+    if not cdip_strs:
+        return np.array([], dtype='datetime64[s]')
+    if any(len(cdip_str) != 14 for cdip_str in cdip_strs):
+        #- Ragged input, use the scalar parser
+        return np.array([cdip_datetime(cdip_str) or 'NaT' for cdip_str in cdip_strs], dtype='datetime64[s]')
+    try:
+        digits = np.frombuffer(''.join(cdip_strs).encode('ascii'), dtype=np.uint8).reshape(-1, 14).astype(np.int64) - 48
+    except UnicodeEncodeError:
+        return np.array([cdip_datetime(cdip_str) or 'NaT' for cdip_str in cdip_strs], dtype='datetime64[s]')
+    ok = ((digits >= 0) & (digits <= 9)).all(axis=1)
+    pairs = digits[:, 0::2]*10 + digits[:, 1::2] # yy yy mm dd HH MM SS
+    y, mo, d, h, mi, sec = pairs[:, 0]*100 + pairs[:, 1], pairs[:, 2], pairs[:, 3], pairs[:, 4], pairs[:, 5], pairs[:, 6]
+    ok &= (y >= 1) & (mo >= 1) & (mo <= 12) & (h < 24) & (mi < 60) & (sec < 60) & (d >= 1)
+    mo = np.where(ok, mo, 1)
+    month = (y - 1970).astype('datetime64[Y]').astype('datetime64[M]') + (mo - 1)
+    month_days = ((month + 1).astype('datetime64[D]') - month.astype('datetime64[D]')).astype(np.int64)
+    ok &= d <= month_days
+    result = month.astype('datetime64[s]') + ((d - 1)*86400 + h*3600 + mi*60 + sec)
+    result[~ok] = np.datetime64('NaT')
+    return result
      
 def datetime_to_timestamp(dt):
-    return time.mktime(dt.timetuple())
+    """ Returns the epoch timestamp of a utc datetime (naive datetimes are taken to be utc). """
+    if dt.tzinfo is not None:
+        return dt.timestamp()
+    return (dt - _EPOCH).total_seconds()
 
 def timestamp_to_datetime(ts):
-     return datetime.fromtimestamp(ts)
+    """ Returns the naive utc datetime of an epoch timestamp, the inverse of datetime_to_timestamp. """
+    return _EPOCH + timedelta(seconds=float(ts))
 
 def datetime_to_format(dt,format=None):
     if format is None:
         return cdip_datestring(dt)
     return dt.strftime(format)
 
+@lru_cache(maxsize=64)
+def _get_tz(tzname):
+    """ Returns the tzinfo for tzname, from zoneinfo or, without a system tz database, pytz. """
+    if ZoneInfo is not None:
+        try:
+            return ZoneInfo(tzname)
+        except ZoneInfoNotFoundError:
+            pass
+    import pytz
+    return pytz.timezone(tzname)
+
 def datetime_to_tz(dt, tzname='US/Pacific'):
     """ Returns a non-localized utc datetime object as tzname timezone datetime object. """
-    utc = pytz.utc
-    utc_dt = utc.localize(dt)
-    tz = pytz.timezone(tzname)
-    return utc_dt.astimezone(tz)
+    if tzname == 'UTC':
+        return dt.replace(tzinfo=_UTC)
+    return dt.replace(tzinfo=_UTC).astimezone(_get_tz(tzname))
+
+tz_many_pandas_min = 10000
+
+def datetime_to_tz_many(dts, tzname='US/Pacific'):
+    """ List version of datetime_to_tz. Large inputs are converted with pandas when it is installed. """
+    if tzname == 'UTC':
+        return [dt.replace(tzinfo=_UTC) for dt in dts]
+    tz = _get_tz(tzname)
+    if len(dts) >= tz_many_pandas_min:
+        try:
+            import pandas as pd
+        except ImportError:
+            pass
+        else:
+            return list(pd.DatetimeIndex(dts).tz_localize(_UTC).tz_convert(tz).to_pydatetime())
+    return [dt.replace(tzinfo=_UTC).astimezone(tz) for dt in dts]
 
 # Timespan
+@final
 class Timespan:
     """ Class to handle timespans. """ 
-    def __init__(cls, start_dt, end_dt):
-        cls.start_dt = start_dt
-        cls.end_dt = end_dt
 
-    def overlap(cls, tspan):
+    __slots__ = ('start_dt', 'end_dt')
+
+    def __init__(self, start_dt, end_dt):
+        self.start_dt = start_dt
+        self.end_dt = end_dt
+
+    def overlap(self, tspan: 'Timespan') -> bool:
         """ If supplied timespan overlaps this timespan, returns True. """
-        if cls.start_dt <= tspan.end_dt and cls.end_dt >= tspan.start_dt:
-            return True
-        else:
-            return False
+        return self.start_dt <= tspan.end_dt and self.end_dt >= tspan.start_dt
+
+    def as_epoch_ns(self):
+        """ Returns (start, end) as integer epoch nanoseconds. Datetimes are taken to be utc, numbers to be epoch seconds. """
+        return _epoch_ns(self.start_dt), _epoch_ns(self.end_dt)
+
+    @staticmethod
+    def overlap_matrix(starts1, ends1, starts2, ends2):
+        """ Returns an N x M bool array, True where timespan i of (starts1, ends1) overlaps timespan j of (starts2, ends2). """
+        return (np.less_equal.outer(np.asarray(starts1), np.asarray(ends2)) & 
+            np.greater_equal.outer(np.asarray(ends1), np.asarray(starts2)))
+
+    @staticmethod
+    def overlap_pairs(a, b):
+        """ 
+            Returns a K x 2 array of the (i, j) indices where span a[i] overlaps span b[j], for N x 2 and M x 2 
+            (start, end) arrays. Each array must be sorted and its spans must not overlap one another 
+            (e.g. deployments, observation windows); the sweep is then O(N+M) rather than N x M.
+        """
+        from cdippy._time_kernels import overlap_pairs_sorted
+        a, b = np.asarray(a, dtype=np.int64), np.asarray(b, dtype=np.int64)
+        return overlap_pairs_sorted(a[:, 0], a[:, 1], b[:, 0], b[:, 1])
 
+def _epoch_ns(t):
+    if isinstance(t, datetime):
+        if t.tzinfo is not None:
+            t = t.astimezone(_UTC).replace(tzinfo=None)
+        return (t - _EPOCH) // timedelta(microseconds=1) * 1000
+    if isinstance(t, (int, np.integer)):
+        return int(t) * 10**9
+    return int(round(t * 10**9))
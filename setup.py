@@ -3,7 +3,15 @@
 
 """The setup script."""
 
-from setuptools import setup, find_packages
+from setuptools import setup, find_packages, Extension
+
+try:
+    import Cython # noqa: F401, setuptools cythonizes .pyx sources when it is installed
+except ImportError:
+    ext_modules = []
+else:
+    #- Optional, so installs without a C compiler fall back to the pure Python parser
+    ext_modules = [Extension('cdippy._utils', ['cdippy/_utils.pyx'], optional=True)]
 
 with open('README.rst') as readme_file:
     readme = readme_file.read()
@@ -34,6 +42,7 @@ setup(
         'Programming Language :: Python :: 3.7',
     ],
     description="CDIPpy handles access to CDIP NetCDF data files",
+    ext_modules=ext_modules,
     entry_points={
         'console_scripts': [
             'cdippy=cdippy.cli:main',
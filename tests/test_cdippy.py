@@ -9,6 +9,8 @@ from click.testing import CliRunner
 
 from cdippy import utils 
 from cdippy import cli
+from cdippy import cdippy
+from cdippy.location import Location, LocationArray
 
 
 @pytest.fixture
@@ -38,4 +40,152 @@ def test_command_line_interface():
     assert '--help  Show this message and exit.' in help_result.output
 
 def test_cdip_datetime():
+  utils.cdip_datetime.cache_clear()
   assert str(utils.cdip_datetime('2018')) == '2018-01-01 00:00:00'
+  assert str(utils.cdip_datetime('20180704133005')) == '2018-07-04 13:30:05'
+  assert utils.cdip_datetime('20181301') is None
+
+def test_var_prefix():
+  assert cdippy.var_prefix('waveHs') == 'wave'
+  assert cdippy.var_prefix('xyzData') == 'xyz'
+  assert cdippy.var_prefix('sst') == 'sst'
+
+def test_get_distances():
+  lats, lons = [21.66915, 32.0], [-158.11487, -117.0]
+  l = Location(21.6689, -158.1156)
+  d = l.get_distances(lats, lons)
+  for i in range(2):
+    loc = Location(lats[i], lons[i])
+    assert d[i] == pytest.approx(l.get_distance(loc))
+    # Repeat calls must not change loc
+    assert d[i] == pytest.approx(l.get_distance(loc))
+    assert loc.latitude == lats[i]
+
+def test_location_array():
+  locs = [Location(21.66915, -158.11487), Location(32.0, -117.0)]
+  d = LocationArray(locs).distances_from(21.6689, -158.1156)
+  assert list(d) == pytest.approx([Location(21.6689, -158.1156).get_distance(l) for l in locs])
+
+def test_datetime_to_tz_many():
+  from datetime import datetime, timedelta
+  dts = [datetime(2018, 3, 11) + timedelta(hours=i) for i in range(utils.tz_many_pandas_min)]
+  expected = [utils.datetime_to_tz(dt) for dt in dts]
+  assert utils.datetime_to_tz_many(dts) == expected
+  assert utils.datetime_to_tz_many(dts[:10]) == expected[:10]
+
+def test_timespan_overlap_pairs():
+  a = [[0, 10], [20, 30], [40, 50]]
+  b = [[5, 25], [30, 35], [60, 70]]
+  pairs = utils.Timespan.overlap_pairs(a, b)
+  assert [tuple(p) for p in pairs] == [(0, 0), (1, 0), (1, 1)]
+
+def test_pkl_out_of_band(tmp_path):
+  import numpy as np
+  obj = {'a': np.arange(100000.0), 'b': 'text'}
+  fl = str(tmp_path / 'oob.pkl')
+  assert utils.pkl_dump(obj, fl, out_of_band=True)
+  loaded = utils.pkl_load(fl, out_of_band=True)
+  assert loaded['b'] == 'text' and (loaded['a'] == obj['a']).all()
+  loaded['a'][0] = 1.0 # Writable
+  plain = str(tmp_path / 'plain.pkl')
+  utils.pkl_dump('a string', plain)
+  assert utils.pkl_load(plain, out_of_band=True) is None
+  with open(fl, 'r+b') as f:
+    f.truncate(50000)
+  assert utils.pkl_load(fl, out_of_band=True) is None
+
+def test_get_time_indices(tmp_path):
+  import netCDF4
+  import numpy as np
+  rng = np.random.RandomState(0)
+  # Non-uniform sampling: irregular steps, a long gap and duplicate times
+  steps = rng.randint(1, 3600, 2000)
+  steps[700] = 30*86400
+  steps[1200:1210] = 0
+  times = 1.4e9 + np.cumsum(steps)
+  nc = netCDF4.Dataset(str(tmp_path / 'times.nc'), 'w')
+  nc.createDimension('waveTime', len(times))
+  t = nc.createVariable('waveTime', 'i4', ('waveTime',))
+  t[:] = times
+  c = cdippy.CDIPnc()
+  for w in [8, 64]:
+    c.time_search_window = w
+    for _ in range(500):
+      s, e = np.sort(rng.uniform(times[0] - 86400, times[-1] + 86400, 2))
+      if rng.rand() < 0.3: # Stamps landing on sample times
+        s, e = np.sort(rng.choice(times, 2))
+      assert c.get_time_indices(t, s, e) == c.get_indices(times, s, e)
+  nc.close()
+
+def _flag_nc(fl):
+  import netCDF4
+  import numpy as np
+  rng = np.random.RandomState(1)
+  nc = netCDF4.Dataset(fl, 'w')
+  nc.createDimension('waveTime', 400)
+  nc.createDimension('sstTime', 100)
+  nc.createDimension('metaStationCount', 4)
+  # 1-d flags as in station files, 2-d as in the latest file, some missing
+  for prefix, dims in [('wave', ('waveTime',)), ('sst', ('sstTime', 'metaStationCount'))]:
+    shape = tuple(len(nc.dimensions[d]) for d in dims)
+    for name, values in [('FlagPrimary', [1, 1, 2, 3, 4, 9]), ('FlagSecondary', [0, 1, 1, 2])]:
+      v = nc.createVariable(prefix+name, 'i1', dims, fill_value=-127)
+      flags = rng.choice(values, shape).astype('i1')
+      flags[rng.rand(*shape) < 0.05] = -127
+      v[:] = flags
+  nc.close()
+
+def test_pub_mask_backends(tmp_path, monkeypatch):
+  import netCDF4
+  import numpy as np
+  pytest.importorskip('numba')
+  fl = str(tmp_path / 'flags.nc')
+  _flag_nc(fl)
+  c = cdippy.CDIPnc()
+  c.nc = netCDF4.Dataset(fl)
+  c.nc.set_always_mask(False)
+  pub_sets = sorted(set(c.get_pub_set(name) for name in c.pub_set_names))
+  anc_names = ['waveFlagPrimary', 'sstFlagPrimary']
+
+  def masks():
+    result = {}
+    for pub_set in pub_sets:
+      c.pub_set = pub_set
+      for anc_name in anc_names:
+        result[pub_set, anc_name] = np.asarray(c.make_pub_mask(anc_name, None, None))
+    return result
+
+  # The NumPy table is the reference
+  from cdippy import _flag_kernels
+  monkeypatch.setattr(_flag_kernels, 'both_goodall_mask', c.pub_mask_rules['both-goodall'])
+  expected = masks()
+  monkeypatch.undo()
+  got = masks()
+  for key in expected:
+    assert got[key].shape == expected[key].shape
+    assert (got[key] == expected[key]).all(), key
+    # Records with a missing primary flag are always masked out
+    assert expected[key][np.ma.getmaskarray(c.get_var(key[1])[:])].all(), key
+  c.nc.close()
+
+def test_cdip_datetimes():
+  import numpy as np
+  strs = ['20180704133005', '20160229000000', '20170229000000', '00000101000000',
+    '20181301000000', '2018070413300a', '19991231235959']
+  expected = [utils.cdip_datetime(s) or 'NaT' for s in strs]
+  # Compare as strings, NaT != NaT
+  assert list(utils.cdip_datetimes(strs).astype(str)) == list(np.array(expected, dtype='datetime64[s]').astype(str))
+  # Ragged input takes the scalar path and must agree
+  ragged = utils.cdip_datetimes(strs + ['2018'])
+  assert list(ragged[:-1].astype(str)) == list(utils.cdip_datetimes(strs).astype(str))
+  assert str(ragged[-1]) == '2018-01-01T00:00:00'
+  valid = [s for s, e in zip(strs, expected) if e != 'NaT']
+  assert list(utils.cdip_datestrings(utils.cdip_datetimes(valid))) == valid
+  assert list(utils.cdip_datestrings([utils.cdip_datetime(s) for s in valid])) == valid
+
+def test_location_moved():
+  l = Location(0.0, 0.0)
+  other = Location(32.0, -117.0)
+  l.latitude, l.longitude = 21.6689, -158.1156
+  assert l.get_distance(other) == pytest.approx(Location(21.6689, -158.1156).get_distance(other))
+  assert l.get_direction(other) == pytest.approx(Location(21.6689, -158.1156).get_direction(other))